@@ -0,0 +1,225 @@
+# backend/idempotency.py
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import delete, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import models
+
+logger = logging.getLogger(__name__)
+
+# 環境変数から取得するか、デフォルト値を使用
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", 60 * 60 * 24))
+IDEMPOTENCY_PURGE_INTERVAL_SECONDS = int(os.getenv("IDEMPOTENCY_PURGE_INTERVAL_SECONDS", 60))
+SINGLE_FLIGHT_WAIT_SECONDS = float(os.getenv("SINGLE_FLIGHT_WAIT_SECONDS", 5))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+# 一意制約の衝突後に保存済みの行が見つからない状態を再試行する回数
+IDEMPOTENCY_MAX_RETRIES = 3
+
+
+def _fingerprint(body: Any) -> str:
+    encoded = json.dumps(jsonable_encoder(body), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    """Idempotency-Keyごとに書き込み結果をDBに保持する、TTL付きのストア
+
+    キーの行とレスポンスは書き込みと同じトランザクションでコミットされるため、
+    どのワーカーに再送されても一意制約によって処理が再実行されず、保存済みの
+    レスポンスを返す。コミット前に失敗した場合は書き込みもキーも残らない。
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = IDEMPOTENCY_TTL_SECONDS,
+        purge_interval_seconds: float = IDEMPOTENCY_PURGE_INTERVAL_SECONDS,
+        clock: Callable[[], datetime] = datetime.utcnow,
+    ):
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.purge_interval_seconds = purge_interval_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._next_purge = 0.0
+
+    def run(
+        self,
+        db: Session,
+        idempotency_key: Optional[str],
+        user_id: int,
+        method: str,
+        path: str,
+        body: Any,
+        fn: Callable[[], Any],
+        on_commit: Optional[Callable[[Any], None]] = None,
+    ):
+        """fnを実行してコミットする。idempotency_keyが指定されていれば、保存済みの結果を再利用する
+
+        fnはdbをコミットせずflushまでにとどめる書き込み処理で、コミットはここで行う。
+        on_commitはコミット後に結果を受け取る処理で、再送で結果を再利用した場合は呼ばれない。
+        書き込みはコミット済みのため、on_commitの失敗はログに残すだけでレスポンスは返す。
+        bodyはリクエスト内容で、同じキーが異なる内容で再利用された場合は422を返す。
+        """
+        if not idempotency_key:
+            return self._execute(db, None, fn, on_commit)
+        if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise HTTPException(status_code=400, detail="Idempotency-Key is too long")
+
+        fingerprint = _fingerprint(body)
+        self._purge_expired(db)
+        for _ in range(IDEMPOTENCY_MAX_RETRIES):
+            record = self._find(db, user_id, method, path, idempotency_key)
+            if record is not None and record.expires_at <= self.clock():
+                db.delete(record)
+                db.commit()
+                record = None
+
+            if record is not None:
+                if record.fingerprint != fingerprint:
+                    raise HTTPException(
+                        status_code=422,
+                        detail="Idempotency-Key has already been used with a different request",
+                    )
+                return json.loads(record.response)
+
+            record = models.IdempotencyKey(
+                user_id=user_id,
+                method=method,
+                path=path,
+                key=idempotency_key,
+                fingerprint=fingerprint,
+                expires_at=self.clock() + self.ttl,
+            )
+            db.add(record)
+            try:
+                db.flush()
+            except IntegrityError:
+                # 他のワーカーが同じキーで先にコミットした
+                db.rollback()
+                continue
+            return self._execute(db, record, fn, on_commit)
+
+        raise HTTPException(
+            status_code=409,
+            detail="A request with this Idempotency-Key is still being processed",
+        )
+
+    def _execute(self, db: Session, record: Optional[models.IdempotencyKey], fn: Callable[[], Any], on_commit):
+        try:
+            result = fn()
+            if record is not None:
+                record.response = json.dumps(jsonable_encoder(result), ensure_ascii=False)
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+        if on_commit is not None:
+            try:
+                on_commit(result)
+            except Exception as e:
+                logger.error(f"コミット後の処理に失敗: {e}")
+        return result
+
+    def _find(self, db: Session, user_id: int, method: str, path: str, key: str) -> Optional[models.IdempotencyKey]:
+        return db.query(models.IdempotencyKey).filter(
+            models.IdempotencyKey.user_id == user_id,
+            models.IdempotencyKey.method == method,
+            models.IdempotencyKey.path == path,
+            models.IdempotencyKey.key == key,
+        ).first()
+
+    def _purge_expired(self, db: Session):
+        # 期限切れの行の削除はワーカーごとに一定間隔でのみ行う
+        with self._lock:
+            if time.monotonic() < self._next_purge:
+                return
+            self._next_purge = time.monotonic() + self.purge_interval_seconds
+        db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.expires_at <= self.clock()))
+        db.commit()
+
+
+# ON CONFLICTで加算できるDBのinsert
+_UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def get_write_version(db: Session, user_id: int) -> int:
+    version = db.query(models.UserWriteVersion.version).filter(
+        models.UserWriteVersion.user_id == user_id
+    ).scalar()
+    return version or 0
+
+
+def bump_write_version(db: Session, user_id: int):
+    """ユーザーの書き込み回数を増やす。書き込みと同じトランザクション内で呼び出す"""
+    table = models.UserWriteVersion
+    insert = _UPSERT_INSERTS.get(db.get_bind().dialect.name)
+    if insert is not None:
+        db.execute(
+            insert(table)
+            .values(user_id=user_id, version=1)
+            .on_conflict_do_update(index_elements=[table.user_id], set_={"version": table.version + 1})
+        )
+        return
+
+    result = db.execute(update(table).where(table.user_id == user_id).values(version=table.version + 1))
+    if result.rowcount == 0:
+        db.add(table(user_id=user_id, version=1))
+        db.flush()
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """同じキーで同時に実行された処理を1回にまとめ、結果を共有する
+
+    先行する処理が一定時間内に終わらない場合、待っていた側は自分で処理を実行する。
+    書き込み後の読み込みで古い結果を受け取らないよう、キーにはget_write_versionの
+    値を含める。
+    """
+
+    def __init__(self, wait_seconds: float = SINGLE_FLIGHT_WAIT_SECONDS):
+        self.wait_seconds = wait_seconds
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not is_leader:
+            if not call.event.wait(self.wait_seconds):
+                return fn()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
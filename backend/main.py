@@ -1,5 +1,5 @@
 # backend/main.py
-from fastapi import FastAPI, Depends, HTTPException, status, Body
+from fastapi import FastAPI, Depends, HTTPException, status, Body, Header
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
@@ -15,6 +15,8 @@ logger = logging.getLogger(__name__)
 import models
 import schemas
 import auth
+import reminders
+from idempotency import IdempotencyStore, SingleFlight, bump_write_version, get_write_version
 from database import get_db, engine
 
 app = FastAPI(title="モダンTODOアプリAPI")
@@ -34,6 +36,10 @@ app.add_middleware(
     max_age=600,
 )
 
+# 再送された書き込みの結果をDBに保持するストアと、同時に来た一覧取得をまとめる仕組み（ワーカーごと）
+idempotency_store = IdempotencyStore()
+todo_list_flight = SingleFlight()
+
 logger.info(f"CORS設定: allow_origins={[FRONTEND_URL, 'http://localhost:3000']}")
 
 # App Engine環境かどうかを確認
@@ -42,6 +48,10 @@ is_appengine = os.getenv('GAE_APPLICATION', None) is not None
 # データベース初期化
 models.Base.metadata.create_all(bind=engine)
 
+# 既存のテーブルにはcreate_allでインデックスが追加されないため個別に作成
+for index in models.Todo.__table__.indexes:
+    index.create(bind=engine, checkfirst=True)
+
 # App Engine環境でインメモリDBを使用する場合のみ初期データを投入
 if is_appengine and os.getenv("DATABASE_URL", "").startswith("sqlite:///:memory:"):
     # セッションの作成
@@ -84,6 +94,16 @@ if is_appengine and os.getenv("DATABASE_URL", "").startswith("sqlite:///:memory:
     finally:
         db.close()
 
+# リマインダースケジューラーの起動・停止（実行するのはリースを取得した1ワーカーのみ）
+@app.on_event("startup")
+def start_reminder_scheduler():
+    if reminders.REMINDERS_ENABLED:
+        reminders.scheduler.start()
+
+@app.on_event("shutdown")
+def stop_reminder_scheduler():
+    reminders.scheduler.stop()
+
 # ルートエンドポイント
 @app.get("/")
 def read_root():
@@ -151,29 +171,37 @@ def get_categories(db: Session = Depends(get_db), current_user: models.User = De
     return categories
 
 @app.post("/categories/", response_model=schemas.Category)
-def create_category(category: schemas.CategoryCreate, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_active_user)):
-    db_category = models.Category(**category.dict(), user_id=current_user.id)
-    db.add(db_category)
-    db.commit()
-    db.refresh(db_category)
-    return db_category
+def create_category(category: schemas.CategoryCreate, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_active_user), idempotency_key: Optional[str] = Header(None)):
+    def create():
+        db_category = models.Category(**category.dict(), user_id=current_user.id)
+        db.add(db_category)
+        bump_write_version(db, current_user.id)
+        db.flush()
+        db.refresh(db_category)
+        return schemas.Category.model_validate(db_category)
+    
+    return idempotency_store.run(db, idempotency_key, current_user.id, "POST", "/categories/", category.dict(), create)
 
 @app.put("/categories/{category_id}", response_model=schemas.Category)
-def update_category(category_id: int, category: schemas.CategoryCreate, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_active_user)):
-    db_category = db.query(models.Category).filter(
-        models.Category.id == category_id,
-        models.Category.user_id == current_user.id
-    ).first()
-    
-    if not db_category:
-        raise HTTPException(status_code=404, detail="Category not found")
-    
-    for key, value in category.dict().items():
-        setattr(db_category, key, value)
+def update_category(category_id: int, category: schemas.CategoryCreate, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_active_user), idempotency_key: Optional[str] = Header(None)):
+    def update():
+        db_category = db.query(models.Category).filter(
+            models.Category.id == category_id,
+            models.Category.user_id == current_user.id
+        ).first()
+        
+        if not db_category:
+            raise HTTPException(status_code=404, detail="Category not found")
+        
+        for key, value in category.dict().items():
+            setattr(db_category, key, value)
+        
+        bump_write_version(db, current_user.id)
+        db.flush()
+        db.refresh(db_category)
+        return schemas.Category.model_validate(db_category)
     
-    db.commit()
-    db.refresh(db_category)
-    return db_category
+    return idempotency_store.run(db, idempotency_key, current_user.id, "PUT", f"/categories/{category_id}", category.dict(), update)
 
 @app.delete("/categories/{category_id}")
 def delete_category(category_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_active_user)):
@@ -191,6 +219,7 @@ def delete_category(category_id: int, db: Session = Depends(get_db), current_use
         todo.category_id = None
     
     db.delete(db_category)
+    bump_write_version(db, current_user.id)
     db.commit()
     
     return {"message": "Category deleted"}
@@ -206,45 +235,59 @@ def get_todos(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_active_user)
 ):
-    query = db.query(models.Todo).filter(models.Todo.user_id == current_user.id)
-    
-    if completed is not None:
-        query = query.filter(models.Todo.completed == completed)
-    
-    if category_id:
-        query = query.filter(models.Todo.category_id == category_id)
-    
-    if priority:
-        query = query.filter(models.Todo.priority == priority)
-    
-    if due_date_from:
-        query = query.filter(models.Todo.due_date >= due_date_from)
-    
-    if due_date_to:
-        query = query.filter(models.Todo.due_date <= due_date_to)
+    def load():
+        query = db.query(models.Todo).filter(models.Todo.user_id == current_user.id)
+        
+        if completed is not None:
+            query = query.filter(models.Todo.completed == completed)
+        
+        if category_id:
+            query = query.filter(models.Todo.category_id == category_id)
+        
+        if priority:
+            query = query.filter(models.Todo.priority == priority)
+        
+        if due_date_from:
+            query = query.filter(models.Todo.due_date >= due_date_from)
+        
+        if due_date_to:
+            query = query.filter(models.Todo.due_date <= due_date_to)
+        
+        return [schemas.Todo.model_validate(t) for t in query.order_by(models.Todo.position).all()]
     
-    return query.order_by(models.Todo.position).all()
+    # 同じユーザーの同じ条件での同時リクエストは1回のクエリにまとめる
+    # （書き込み回数をキーに含め、書き込み前に始まったクエリの結果は共有しない）
+    version = get_write_version(db, current_user.id)
+    key = (current_user.id, version, completed, category_id, priority, due_date_from, due_date_to)
+    return todo_list_flight.do(key, load)
 
 @app.post("/todos/", response_model=schemas.Todo)
-def create_todo(todo: schemas.TodoCreate, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_active_user)):
-    # 最大のposition値を取得
-    max_position = db.query(models.Todo).filter(
-        models.Todo.user_id == current_user.id
-    ).order_by(models.Todo.position.desc()).first()
-    
-    new_position = 0
-    if max_position:
-        new_position = max_position.position + 1
-    
-    # todo.dict()から'position'を除外して新しいデータ辞書を作成
-    todo_data = todo.dict(exclude={"position"})
-    
-    # 除外した辞書を使って新しいTodoオブジェクトを作成
-    db_todo = models.Todo(**todo_data, user_id=current_user.id, position=new_position)
-    db.add(db_todo)
-    db.commit()
-    db.refresh(db_todo)
-    return db_todo
+def create_todo(todo: schemas.TodoCreate, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_active_user), idempotency_key: Optional[str] = Header(None)):
+    def create():
+        # 最大のposition値を取得
+        max_position = db.query(models.Todo).filter(
+            models.Todo.user_id == current_user.id
+        ).order_by(models.Todo.position.desc()).first()
+        
+        new_position = 0
+        if max_position:
+            new_position = max_position.position + 1
+        
+        # todo.dict()から'position'を除外して新しいデータ辞書を作成
+        todo_data = todo.dict(exclude={"position"})
+        
+        # 除外した辞書を使って新しいTodoオブジェクトを作成
+        db_todo = models.Todo(**todo_data, user_id=current_user.id, position=new_position)
+        db.add(db_todo)
+        bump_write_version(db, current_user.id)
+        db.flush()
+        db.refresh(db_todo)
+        return schemas.Todo.model_validate(db_todo)
+    
+    return idempotency_store.run(
+        db, idempotency_key, current_user.id, "POST", "/todos/", todo.dict(), create,
+        on_commit=reminders.scheduler.notify_changed,
+    )
 
 @app.get("/todos/{todo_id}", response_model=schemas.Todo)
 def get_todo(todo_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_active_user)):
@@ -259,30 +302,37 @@ def get_todo(todo_id: int, db: Session = Depends(get_db), current_user: models.U
     return db_todo
 
 @app.put("/todos/{todo_id}", response_model=schemas.Todo)
-def update_todo(todo_id: int, todo: schemas.TodoUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_active_user)):
-    db_todo = db.query(models.Todo).filter(
-        models.Todo.id == todo_id,
-        models.Todo.user_id == current_user.id
-    ).first()
-    
-    if not db_todo:
-        raise HTTPException(status_code=404, detail="Todo not found")
-    
-    update_data = todo.dict(exclude_unset=True)
-    
-    # 完了状態が変更された場合、completed_atを更新
-    if "completed" in update_data and update_data["completed"] != db_todo.completed:
-        if update_data["completed"]:
-            update_data["completed_at"] = datetime.utcnow()
-        else:
-            update_data["completed_at"] = None
-    
-    for key, value in update_data.items():
-        setattr(db_todo, key, value)
-    
-    db.commit()
-    db.refresh(db_todo)
-    return db_todo
+def update_todo(todo_id: int, todo: schemas.TodoUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_active_user), idempotency_key: Optional[str] = Header(None)):
+    def update():
+        db_todo = db.query(models.Todo).filter(
+            models.Todo.id == todo_id,
+            models.Todo.user_id == current_user.id
+        ).first()
+        
+        if not db_todo:
+            raise HTTPException(status_code=404, detail="Todo not found")
+        
+        update_data = todo.dict(exclude_unset=True)
+        
+        # 完了状態が変更された場合、completed_atを更新
+        if "completed" in update_data and update_data["completed"] != db_todo.completed:
+            if update_data["completed"]:
+                update_data["completed_at"] = datetime.utcnow()
+            else:
+                update_data["completed_at"] = None
+        
+        for key, value in update_data.items():
+            setattr(db_todo, key, value)
+        
+        bump_write_version(db, current_user.id)
+        db.flush()
+        db.refresh(db_todo)
+        return schemas.Todo.model_validate(db_todo)
+    
+    return idempotency_store.run(
+        db, idempotency_key, current_user.id, "PUT", f"/todos/{todo_id}", todo.dict(exclude_unset=True), update,
+        on_commit=reminders.scheduler.notify_changed,
+    )
 
 @app.delete("/todos/{todo_id}")
 def delete_todo(todo_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_active_user)):
@@ -295,7 +345,9 @@ def delete_todo(todo_id: int, db: Session = Depends(get_db), current_user: model
         raise HTTPException(status_code=404, detail="Todo not found")
     
     db.delete(db_todo)
+    bump_write_version(db, current_user.id)
     db.commit()
+    reminders.scheduler.notify_deleted(todo_id)
     
     return {"message": "Todo deleted"}
 
@@ -303,21 +355,26 @@ def delete_todo(todo_id: int, db: Session = Depends(get_db), current_user: model
 def reorder_todos(
     todo_ids: List[int] = Body(...),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_active_user)
+    current_user: models.User = Depends(auth.get_current_active_user),
+    idempotency_key: Optional[str] = Header(None)
 ):
-    # 順序の更新
-    for i, todo_id in enumerate(todo_ids):
-        todo = db.query(models.Todo).filter(
-            models.Todo.id == todo_id,
-            models.Todo.user_id == current_user.id
-        ).first()
+    def reorder():
+        # 順序の更新
+        for i, todo_id in enumerate(todo_ids):
+            todo = db.query(models.Todo).filter(
+                models.Todo.id == todo_id,
+                models.Todo.user_id == current_user.id
+            ).first()
+            
+            if todo:
+                todo.position = i
         
-        if todo:
-            todo.position = i
-    
-    db.commit()
+        bump_write_version(db, current_user.id)
+        db.flush()
+        
+        return {"message": "Todos reordered successfully"}
     
-    return {"message": "Todos reordered successfully"}
+    return idempotency_store.run(db, idempotency_key, current_user.id, "POST", "/todos/reorder", todo_ids, reorder)
 
 # ユーザー情報取得
 @app.get("/users/me/", response_model=schemas.User)
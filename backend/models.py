@@ -1,5 +1,5 @@
 # backend/models.py
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Enum
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Enum, Text, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -45,11 +45,52 @@ class Todo(Base):
     completed = Column(Boolean, default=False)
     priority = Column(Enum(PriorityEnum), default=PriorityEnum.MEDIUM)
     created_at = Column(DateTime, default=datetime.utcnow)
-    due_date = Column(DateTime, nullable=True)
+    due_date = Column(DateTime, nullable=True, index=True)  # リマインダーの範囲検索用
     completed_at = Column(DateTime, nullable=True)
     position = Column(Integer, default=0)  # 表示順序
     user_id = Column(Integer, ForeignKey("users.id"))
     category_id = Column(Integer, ForeignKey("categories.id"), nullable=True)
     
     owner = relationship("User", back_populates="todos")
-    category = relationship("Category", back_populates="todos")
\ No newline at end of file
+    category = relationship("Category", back_populates="todos")
+
+class SchedulerLease(Base):
+    """複数ワーカー間でスケジューラーの実行権を調整するためのリース"""
+    __tablename__ = "scheduler_leases"
+
+    name = Column(String, primary_key=True)
+    owner = Column(String, nullable=True)
+    expires_at = Column(DateTime, nullable=True)
+    watermark = Column(DateTime, nullable=True)  # これ以前のdue_dateは処理済み
+
+class ReminderDelivery(Base):
+    """リマインダーの送信記録（同じTODO・同じ期限への二重送信を防ぎ、失敗時は再試行する）"""
+    __tablename__ = "reminder_deliveries"
+
+    todo_id = Column(Integer, primary_key=True)
+    due_date = Column(DateTime, primary_key=True, index=True)
+    attempts = Column(Integer, default=0)
+    claimed_at = Column(DateTime, nullable=True)  # 送信中の場合のみ設定
+    sent_at = Column(DateTime, nullable=True)  # 送信に成功するまではNone
+
+class IdempotencyKey(Base):
+    """Idempotency-Keyごとに保存した書き込みのレスポンス"""
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (UniqueConstraint("user_id", "method", "path", "key"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    method = Column(String)
+    path = Column(String)
+    key = Column(String)
+    fingerprint = Column(String)  # リクエスト内容のハッシュ
+    response = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, index=True)
+
+class UserWriteVersion(Base):
+    """ユーザーごとの書き込み回数（一覧取得をまとめる際に書き込み前の結果を共有しないため）"""
+    __tablename__ = "user_write_versions"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    version = Column(Integer, default=0)
@@ -0,0 +1,470 @@
+# backend/reminders.py
+import heapq
+import json
+import logging
+import os
+import socket
+import threading
+import urllib.request
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, func, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# 環境変数から取得するか、デフォルト値を使用
+REMINDERS_ENABLED = os.getenv("REMINDERS_ENABLED", "true").lower() in ("1", "true", "yes")
+REMINDER_SINK = os.getenv("REMINDER_SINK", "log")
+REMINDER_WEBHOOK_URL = os.getenv("REMINDER_WEBHOOK_URL")
+REMINDER_WINDOW_MINUTES = int(os.getenv("REMINDER_WINDOW_MINUTES", 15))
+REMINDER_REFRESH_SECONDS = int(os.getenv("REMINDER_REFRESH_SECONDS", 60))
+REMINDER_LEASE_SECONDS = int(os.getenv("REMINDER_LEASE_SECONDS", 30))
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", 500))
+# 他のワーカーでのコミット遅延や時計のずれを吸収するため、読み込み範囲をこの分だけ戻す
+REMINDER_GRACE_SECONDS = int(os.getenv("REMINDER_GRACE_SECONDS", 30))
+# 送信に失敗したリマインダーを再試行する上限回数（初回を含む）
+REMINDER_MAX_ATTEMPTS = int(os.getenv("REMINDER_MAX_ATTEMPTS", 3))
+# 送信中のまま応答がない（ワーカーが停止した）とみなして再試行するまでの秒数
+REMINDER_CLAIM_TIMEOUT_SECONDS = int(os.getenv("REMINDER_CLAIM_TIMEOUT_SECONDS", 300))
+
+LEASE_NAME = "due_date_reminders"
+
+
+@dataclass
+class Reminder:
+    todo_id: int
+    user_id: int
+    task: str
+    due_date: datetime
+
+
+# 通知先（シンク）
+def log_sink(reminder: Reminder):
+    logger.info(f"リマインダー: todo_id={reminder.todo_id} user_id={reminder.user_id} "
+                f"task={reminder.task!r} due_date={reminder.due_date.isoformat()}")
+
+
+def make_webhook_sink(url: str, timeout: float = 5.0) -> Callable[[Reminder], None]:
+    def webhook_sink(reminder: Reminder):
+        payload = json.dumps({
+            "todo_id": reminder.todo_id,
+            "user_id": reminder.user_id,
+            "task": reminder.task,
+            "due_date": reminder.due_date.isoformat(),
+        }).encode("utf-8")
+        request = urllib.request.Request(
+            url, data=payload, headers={"Content-Type": "application/json"}, method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=timeout):
+            pass
+
+    return webhook_sink
+
+
+def build_sink_from_env() -> Callable[[Reminder], None]:
+    if REMINDER_SINK == "webhook":
+        if REMINDER_WEBHOOK_URL:
+            return make_webhook_sink(REMINDER_WEBHOOK_URL)
+        logger.warning("REMINDER_WEBHOOK_URLが未設定のため、ログ出力にフォールバックします")
+    return log_sink
+
+
+# DBの値はnaiveなUTCで保存されているため、比較前にそろえる
+def to_naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class _LeaseLost(Exception):
+    pass
+
+
+class ReminderScheduler:
+    """期限が近いTODOだけをヒープに載せてリマインダーを送るスケジューラー
+
+    due_dateのインデックスを使って次のウィンドウ分だけを読み込み、
+    全件スキャンは行わない。複数ワーカー環境ではDB上のリースを取得した
+    ワーカーだけが実行する。
+
+    他のワーカーで作成・更新されたTODOは次のウィンドウ読み込みまで見えないため、
+    リースのwatermark（読み込みの下限）は読み込み時刻からgrace分戻した位置までしか
+    進めない。下限より後の送信済みのものはreminder_deliveriesで除外する。
+
+    送信は最大max_attempts回までのat-least-onceで、シンクが例外を送出した場合は
+    次のウィンドウ読み込みで再試行する。再試行待ちのものより先にwatermarkは進めない。
+    """
+
+    def __init__(
+        self,
+        sink: Callable[[Reminder], None],
+        session_factory: Callable[[], Session] = SessionLocal,
+        window: timedelta = timedelta(minutes=REMINDER_WINDOW_MINUTES),
+        refresh_interval: timedelta = timedelta(seconds=REMINDER_REFRESH_SECONDS),
+        lease_duration: timedelta = timedelta(seconds=REMINDER_LEASE_SECONDS),
+        grace: timedelta = timedelta(seconds=REMINDER_GRACE_SECONDS),
+        batch_size: int = REMINDER_BATCH_SIZE,
+        max_attempts: int = REMINDER_MAX_ATTEMPTS,
+        claim_timeout: timedelta = timedelta(seconds=REMINDER_CLAIM_TIMEOUT_SECONDS),
+        clock: Callable[[], datetime] = datetime.utcnow,
+    ):
+        self.sink = sink
+        self.session_factory = session_factory
+        self.window = window
+        self.refresh_interval = refresh_interval
+        self.lease_duration = lease_duration
+        self.grace = grace
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.claim_timeout = claim_timeout
+        self.clock = clock
+        self.owner_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+        # ヒープの要素は(due_date, todo_id)。_entriesにない・値が異なる要素は無効（遅延削除）
+        self._heap: List[Tuple[datetime, int]] = []
+        self._entries: Dict[int, datetime] = {}
+        self._is_leader = False
+        self._watermark: Optional[datetime] = None
+        self._horizon: Optional[datetime] = None
+        self._truncated = False
+        self._next_refresh: Optional[datetime] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="reminder-scheduler", daemon=True)
+        self._thread.start()
+        logger.info(f"リマインダースケジューラーを開始しました: owner={self.owner_id}")
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+        if self._is_leader:
+            db = self.session_factory()
+            try:
+                self._release_lease(db)
+            except Exception as e:
+                logger.error(f"リースの解放に失敗: {e}")
+            finally:
+                db.close()
+        self._reset()
+
+    # TODOの作成・更新時に呼び出す
+    def notify_changed(self, todo: models.Todo):
+        due = to_naive_utc(todo.due_date)
+        with self._lock:
+            if not self._is_leader:
+                return
+            self._entries.pop(todo.id, None)
+            if todo.completed or due is None:
+                return
+            if self._watermark is not None and due <= self._watermark:
+                return
+            if self._horizon is None or due > self._horizon:
+                return
+            self._entries[todo.id] = due
+            heapq.heappush(self._heap, (due, todo.id))
+            is_earliest = self._heap[0] == (due, todo.id)
+        if is_earliest:
+            self._wake.set()
+
+    # TODOの削除時に呼び出す
+    def notify_deleted(self, todo_id: int):
+        with self._lock:
+            self._entries.pop(todo_id, None)
+
+    def _reset(self):
+        with self._lock:
+            self._heap = []
+            self._entries = {}
+            self._is_leader = False
+            self._watermark = None
+            self._horizon = None
+            self._truncated = False
+            self._next_refresh = None
+
+    def _run(self):
+        while not self._stopping:
+            timeout = self.lease_duration.total_seconds() / 3
+            try:
+                timeout = self._tick(self.clock())
+            except Exception as e:
+                logger.error(f"リマインダースケジューラーのエラー: {e}")
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+    def _tick(self, now: datetime) -> float:
+        """1回分の処理を行い、次に起床するまでの秒数を返す"""
+        renew_after = self.lease_duration.total_seconds() / 3
+        db = self.session_factory()
+        try:
+            lease = self._acquire_lease(db, now)
+            if lease is None:
+                if self._is_leader:
+                    logger.info("リマインダースケジューラーのリースを失いました")
+                    self._reset()
+                return renew_after
+
+            if not self._is_leader:
+                logger.info(f"リマインダースケジューラーのリースを取得しました: owner={self.owner_id}")
+                with self._lock:
+                    self._is_leader = True
+                    self._watermark = to_naive_utc(lease.watermark) or now
+
+            refreshed = False
+            if self._next_refresh is None or now >= self._next_refresh:
+                self._load_window(db, now)
+                refreshed = True
+
+            self._dispatch_due(db, now)
+
+            # 読み込み時点で見えていたnow以前のものはすべて処理済みなので、下限を進められる
+            if refreshed and not self._truncated:
+                self._advance_watermark(db, now - self.grace)
+
+            with self._lock:
+                next_due = self._heap[0][0] if self._heap else None
+            timeout = min(renew_after, (self._next_refresh - now).total_seconds())
+            if next_due is not None:
+                timeout = min(timeout, (next_due - now).total_seconds())
+            return max(timeout, 0.0)
+        except _LeaseLost:
+            logger.info("リマインダーの送信中にリースを失いました")
+            self._reset()
+            return renew_after
+        finally:
+            db.close()
+
+    def _acquire_lease(self, db: Session, now: datetime) -> Optional[models.SchedulerLease]:
+        """リースを取得または延長する。他のワーカーが保持している場合はNoneを返す"""
+        expires_at = now + self.lease_duration
+        result = db.execute(
+            update(models.SchedulerLease)
+            .where(
+                models.SchedulerLease.name == LEASE_NAME,
+                (models.SchedulerLease.owner == self.owner_id)
+                | (models.SchedulerLease.expires_at == None)  # noqa: E711
+                | (models.SchedulerLease.expires_at < now),
+            )
+            .values(owner=self.owner_id, expires_at=expires_at)
+        )
+        if result.rowcount == 1:
+            db.commit()
+            return db.get(models.SchedulerLease, LEASE_NAME)
+
+        if db.get(models.SchedulerLease, LEASE_NAME) is not None:
+            db.rollback()
+            return None
+
+        # 初回のみリースの行を作成する（同時に作成された場合は一意制約で負ける）
+        lease = models.SchedulerLease(
+            name=LEASE_NAME, owner=self.owner_id, expires_at=expires_at, watermark=now
+        )
+        db.add(lease)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            return None
+        return lease
+
+    def _renew_lease(self, db: Session, **values):
+        """保持中のリースを延長する。失っていた場合は_LeaseLostを送出する"""
+        result = db.execute(
+            update(models.SchedulerLease)
+            .where(
+                models.SchedulerLease.name == LEASE_NAME,
+                models.SchedulerLease.owner == self.owner_id,
+            )
+            .values(expires_at=self.clock() + self.lease_duration, **values)
+        )
+        if result.rowcount != 1:
+            db.rollback()
+            raise _LeaseLost()
+
+    def _release_lease(self, db: Session):
+        db.execute(
+            update(models.SchedulerLease)
+            .where(
+                models.SchedulerLease.name == LEASE_NAME,
+                models.SchedulerLease.owner == self.owner_id,
+            )
+            .values(owner=None, expires_at=None)
+        )
+        db.commit()
+
+    def _load_window(self, db: Session, now: datetime):
+        """watermarkからウィンドウ終端までの未送信・未完了TODOを読み込み、ヒープを作り直す"""
+        with self._lock:
+            start = self._watermark
+        horizon = now + self.window
+
+        rows = (
+            db.query(models.Todo.id, models.Todo.due_date)
+            .outerjoin(
+                models.ReminderDelivery,
+                and_(
+                    models.ReminderDelivery.todo_id == models.Todo.id,
+                    models.ReminderDelivery.due_date == models.Todo.due_date,
+                ),
+            )
+            .filter(
+                models.Todo.due_date > start,
+                models.Todo.due_date <= horizon,
+                models.Todo.completed == False,  # noqa: E712
+                or_(
+                    models.ReminderDelivery.todo_id == None,  # noqa: E711
+                    self._retryable(),
+                ),
+            )
+            .order_by(models.Todo.due_date, models.Todo.id)
+            .limit(self.batch_size)
+            .all()
+        )
+        # 件数が上限に達した場合は、読み込めた範囲までをウィンドウとし、その時刻に読み直す。
+        # 同じdue_dateで読み切れなかったものは送信済みの除外によって次回読み込まれる
+        truncated = len(rows) == self.batch_size
+        next_refresh = now + self.refresh_interval
+        if truncated:
+            horizon = rows[-1].due_date
+            next_refresh = min(next_refresh, horizon)
+
+        with self._lock:
+            self._entries = {row.id: row.due_date for row in rows}
+            self._heap = [(due, todo_id) for todo_id, due in self._entries.items()]
+            heapq.heapify(self._heap)
+            self._horizon = horizon
+            self._truncated = truncated
+            self._next_refresh = next_refresh
+
+    def _dispatch_due(self, db: Session, now: datetime):
+        due_entries: Dict[int, datetime] = {}
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due, todo_id = heapq.heappop(self._heap)
+                if self._entries.get(todo_id) == due:
+                    del self._entries[todo_id]
+                    due_entries[todo_id] = due
+        if not due_entries:
+            return
+
+        # 他のワーカーで変更されている可能性があるため、送信前に主キーで確認する
+        todos = db.query(models.Todo).filter(models.Todo.id.in_(list(due_entries))).all()
+        pending = [
+            Reminder(todo_id=todo.id, user_id=todo.user_id, task=todo.task, due_date=due_entries[todo.id])
+            for todo in todos
+            if not todo.completed and to_naive_utc(todo.due_date) == due_entries[todo.id]
+        ]
+        db.rollback()
+
+        for reminder in sorted(pending, key=lambda r: (r.due_date, r.todo_id)):
+            attempt = self._claim(db, reminder)
+            if attempt is None:
+                continue
+            try:
+                self.sink(reminder)
+            except Exception as e:
+                logger.error(f"リマインダーの送信に失敗: todo_id={reminder.todo_id} "
+                             f"attempt={attempt}/{self.max_attempts} error={e}")
+                self._finish(db, reminder, claimed_at=None)
+                continue
+            self._finish(db, reminder, claimed_at=None, sent_at=self.clock())
+
+    def _finish(self, db: Session, reminder: Reminder, **values):
+        db.execute(
+            update(models.ReminderDelivery)
+            .where(
+                models.ReminderDelivery.todo_id == reminder.todo_id,
+                models.ReminderDelivery.due_date == reminder.due_date,
+            )
+            .values(**values)
+        )
+        db.commit()
+
+    def _pending(self):
+        """未送信で、まだ試行できる送信記録"""
+        return and_(
+            models.ReminderDelivery.sent_at == None,  # noqa: E711
+            models.ReminderDelivery.attempts < self.max_attempts,
+        )
+
+    def _retryable(self):
+        """_pendingのうち、送信中でない（失敗した・送信中のまま止まった）もの"""
+        return and_(
+            self._pending(),
+            or_(
+                models.ReminderDelivery.claimed_at == None,  # noqa: E711
+                models.ReminderDelivery.claimed_at < self.clock() - self.claim_timeout,
+            ),
+        )
+
+    def _claim(self, db: Session, reminder: Reminder) -> Optional[int]:
+        """リースを延長しつつ送信の試行を記録し、試行回数を返す
+
+        送信済み・試行回数の上限に達した・他のワーカーが先に記録した場合はNoneを返す。
+        """
+        self._renew_lease(db)
+        delivery = db.get(models.ReminderDelivery, (reminder.todo_id, reminder.due_date))
+        if delivery is None:
+            db.add(models.ReminderDelivery(
+                todo_id=reminder.todo_id, due_date=reminder.due_date, attempts=1, claimed_at=self.clock()
+            ))
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                return None
+            return 1
+
+        attempts = delivery.attempts
+        result = db.execute(
+            update(models.ReminderDelivery)
+            .where(
+                models.ReminderDelivery.todo_id == reminder.todo_id,
+                models.ReminderDelivery.due_date == reminder.due_date,
+                models.ReminderDelivery.attempts == attempts,
+                self._retryable(),
+            )
+            .values(attempts=attempts + 1, claimed_at=self.clock())
+        )
+        if result.rowcount != 1:
+            db.rollback()
+            return None
+        db.commit()
+        return attempts + 1
+
+    def _advance_watermark(self, db: Session, watermark: datetime):
+        # 再試行待ちのリマインダーが読み込み範囲から外れないようにする
+        retry_due = db.query(func.min(models.ReminderDelivery.due_date)).filter(self._pending()).scalar()
+        if retry_due is not None:
+            watermark = min(watermark, retry_due - timedelta(microseconds=1))
+        with self._lock:
+            if self._watermark is not None and watermark <= self._watermark:
+                return
+        self._renew_lease(db, watermark=watermark)
+        # 下限より前の送信記録は以後参照しないため削除する
+        db.execute(delete(models.ReminderDelivery).where(models.ReminderDelivery.due_date <= watermark))
+        db.commit()
+        with self._lock:
+            self._watermark = watermark
+
+
+scheduler = ReminderScheduler(sink=build_sink_from_env())
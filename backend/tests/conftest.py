@@ -0,0 +1,36 @@
+# backend/tests/conftest.py
+import os
+import sys
+import tempfile
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# アプリのモジュールはbackend直下からインポートされる前提のため、パスを通す
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# main.appを使うテストは一時ファイルのSQLiteに対して実行し、スケジューラーは起動しない
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'app.db')}"
+os.environ["REMINDERS_ENABLED"] = "false"
+
+import models
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    # ワーカー同士が別々の接続を使う状況を再現するため、ファイルのSQLiteを使う
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    models.Base.metadata.create_all(bind=engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def user(session_factory):
+    db = session_factory()
+    db_user = models.User(email="test@example.com", username="testuser", hashed_password="x")
+    db.add(db_user)
+    db.commit()
+    db.refresh(db_user)
+    db.close()
+    return db_user
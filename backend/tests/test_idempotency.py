@@ -0,0 +1,280 @@
+# backend/tests/test_idempotency.py
+import json
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+import models
+from idempotency import IdempotencyStore, SingleFlight, _fingerprint, bump_write_version, get_write_version
+
+
+def make_create(db, user, calls):
+    def create():
+        calls.append(1)
+        todo = models.Todo(task="task", user_id=user.id)
+        db.add(todo)
+        db.flush()
+        db.refresh(todo)
+        return {"id": todo.id, "task": todo.task}
+
+    return create
+
+
+def count_todos(session_factory):
+    db = session_factory()
+    try:
+        return db.query(models.Todo).count()
+    finally:
+        db.close()
+
+
+def test_replay_with_same_body_returns_stored_response(session_factory, user):
+    store, calls = IdempotencyStore(), []
+    db = session_factory()
+    first = store.run(db, "key-1", user.id, "POST", "/todos/", {"task": "task"}, make_create(db, user, calls))
+    second = store.run(db, "key-1", user.id, "POST", "/todos/", {"task": "task"}, make_create(db, user, calls))
+    db.close()
+
+    assert second == first
+    assert len(calls) == 1
+    assert count_todos(session_factory) == 1
+
+
+def test_replay_on_another_worker_returns_stored_response(session_factory, user):
+    calls = []
+    db_a, db_b = session_factory(), session_factory()
+    first = IdempotencyStore().run(db_a, "key-1", user.id, "POST", "/todos/", {"task": "task"}, make_create(db_a, user, calls))
+    second = IdempotencyStore().run(db_b, "key-1", user.id, "POST", "/todos/", {"task": "task"}, make_create(db_b, user, calls))
+    db_a.close()
+    db_b.close()
+
+    assert second == first
+    assert len(calls) == 1
+    assert count_todos(session_factory) == 1
+
+
+def test_reuse_with_different_body_is_rejected(session_factory, user):
+    store, calls = IdempotencyStore(), []
+    db = session_factory()
+    store.run(db, "key-1", user.id, "POST", "/todos/", {"task": "a"}, make_create(db, user, calls))
+    with pytest.raises(HTTPException) as exc_info:
+        store.run(db, "key-1", user.id, "POST", "/todos/", {"task": "b"}, make_create(db, user, calls))
+    db.close()
+
+    assert exc_info.value.status_code == 422
+    assert len(calls) == 1
+
+
+def test_keys_are_scoped_by_path(session_factory, user):
+    store, calls = IdempotencyStore(), []
+    db = session_factory()
+    store.run(db, "key-1", user.id, "POST", "/todos/", {}, make_create(db, user, calls))
+    store.run(db, "key-1", user.id, "POST", "/categories/", {}, make_create(db, user, calls))
+    db.close()
+
+    assert len(calls) == 2
+
+
+def test_failed_call_is_not_stored(session_factory, user):
+    store, calls = IdempotencyStore(), []
+    db = session_factory()
+
+    def fail():
+        raise HTTPException(status_code=404, detail="Todo not found")
+
+    with pytest.raises(HTTPException):
+        store.run(db, "key-1", user.id, "PUT", "/todos/1", {}, fail)
+    store.run(db, "key-1", user.id, "PUT", "/todos/1", {}, make_create(db, user, calls))
+    db.close()
+
+    assert len(calls) == 1
+
+
+def test_failure_after_write_before_commit_leaves_nothing(session_factory, user):
+    store, calls = IdempotencyStore(), []
+    db = session_factory()
+    create = make_create(db, user, calls)
+
+    def create_then_fail():
+        create()
+        raise ValueError("serialization failed")
+
+    with pytest.raises(ValueError):
+        store.run(db, "key-1", user.id, "POST", "/todos/", {}, create_then_fail)
+    assert count_todos(session_factory) == 0
+
+    store.run(db, "key-1", user.id, "POST", "/todos/", {}, create)
+    db.close()
+
+    assert len(calls) == 2
+    assert count_todos(session_factory) == 1
+
+
+def test_failure_after_commit_still_replays_stored_response(session_factory, user):
+    store, calls = IdempotencyStore(), []
+    db = session_factory()
+
+    def on_commit(result):
+        raise RuntimeError("scheduler unavailable")
+
+    first = store.run(db, "key-1", user.id, "POST", "/todos/", {}, make_create(db, user, calls), on_commit=on_commit)
+    notified = []
+    second = store.run(
+        db, "key-1", user.id, "POST", "/todos/", {}, make_create(db, user, calls), on_commit=notified.append
+    )
+    db.close()
+
+    assert second == first
+    assert len(calls) == 1
+    assert notified == []
+    assert count_todos(session_factory) == 1
+
+
+def test_write_and_response_are_committed_together(session_factory, user):
+    store, calls = IdempotencyStore(), []
+    db = session_factory()
+    store.run(db, "key-1", user.id, "POST", "/todos/", {}, make_create(db, user, calls))
+    db.close()
+
+    db = session_factory()
+    record = db.query(models.IdempotencyKey).one()
+    assert record.fingerprint == _fingerprint({})
+    assert json.loads(record.response)["id"] == db.query(models.Todo).one().id
+    db.close()
+
+
+def test_expired_key_runs_again(session_factory, user):
+    now = [datetime(2026, 1, 1)]
+    store, calls = IdempotencyStore(ttl_seconds=60, clock=lambda: now[0]), []
+    db = session_factory()
+    store.run(db, "key-1", user.id, "POST", "/todos/", {}, make_create(db, user, calls))
+    now[0] += timedelta(seconds=61)
+    store.run(db, "key-1", user.id, "POST", "/todos/", {}, make_create(db, user, calls))
+    db.close()
+
+    assert len(calls) == 2
+
+
+def run_concurrently(flight, started, leader_fn, follower_fn, followers=3):
+    results, errors = [], []
+
+    def call(fn):
+        try:
+            results.append(flight.do("k", fn))
+        except Exception as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call, args=(leader_fn,))
+    leader.start()
+    started.wait()
+    threads = [threading.Thread(target=call, args=(follower_fn,)) for _ in range(followers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    leader.join()
+    return results, errors
+
+
+def test_single_flight_shares_leader_result():
+    flight, started, release = SingleFlight(), threading.Event(), threading.Event()
+
+    def leader_fn():
+        started.set()
+        release.wait(1)
+        return "leader"
+
+    threading.Timer(0.1, release.set).start()
+    results, errors = run_concurrently(flight, started, leader_fn, lambda: "follower")
+
+    assert results == ["leader"] * 4
+    assert errors == []
+
+
+def test_single_flight_followers_get_leader_error():
+    flight, started, release = SingleFlight(), threading.Event(), threading.Event()
+
+    def leader_fn():
+        started.set()
+        release.wait(1)
+        raise ValueError("boom")
+
+    threading.Timer(0.1, release.set).start()
+    results, errors = run_concurrently(flight, started, leader_fn, lambda: "follower")
+
+    assert results == []
+    assert len(errors) == 4 and all(isinstance(e, ValueError) for e in errors)
+
+
+def test_single_flight_follower_falls_back_after_timeout():
+    flight, started, release = SingleFlight(wait_seconds=0.05), threading.Event(), threading.Event()
+
+    def leader_fn():
+        started.set()
+        release.wait(1)
+        return "leader"
+
+    threading.Timer(0.5, release.set).start()
+    results, errors = run_concurrently(flight, started, leader_fn, lambda: "follower")
+
+    assert sorted(results) == ["follower"] * 3 + ["leader"]
+    assert errors == []
+
+
+def test_write_version_counts_committed_writes(session_factory, user):
+    db = session_factory()
+    assert get_write_version(db, user.id) == 0
+    bump_write_version(db, user.id)
+    bump_write_version(db, user.id)
+    db.rollback()
+    assert get_write_version(db, user.id) == 0
+    bump_write_version(db, user.id)
+    db.commit()
+    db.close()
+
+    db = session_factory()
+    assert get_write_version(db, user.id) == 1
+    db.close()
+
+
+def test_read_after_write_does_not_join_older_flight(session_factory, user):
+    flight, started, release = SingleFlight(), threading.Event(), threading.Event()
+
+    def list_key(db):
+        return (user.id, get_write_version(db, user.id))
+
+    def list_tasks(db):
+        return [t.task for t in db.query(models.Todo).order_by(models.Todo.id)]
+
+    # 書き込み前に始まった一覧取得
+    db_old = session_factory()
+    old_tasks = list_tasks(db_old)
+    old_key = list_key(db_old)
+
+    def stale_leader():
+        started.set()
+        release.wait(1)
+        return old_tasks
+
+    results = {}
+    leader = threading.Thread(target=lambda: results.setdefault("leader", flight.do(old_key, stale_leader)))
+    leader.start()
+    started.wait()
+
+    db_write = session_factory()
+    db_write.add(models.Todo(task="new", user_id=user.id))
+    bump_write_version(db_write, user.id)
+    db_write.commit()
+    db_write.close()
+
+    db_new = session_factory()
+    after_write = flight.do(list_key(db_new), lambda: list_tasks(db_new))
+    release.set()
+    leader.join()
+    db_old.close()
+    db_new.close()
+
+    assert results["leader"] == []
+    assert after_write == ["new"]
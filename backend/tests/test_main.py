@@ -0,0 +1,176 @@
+# backend/tests/test_main.py
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+import database
+import main
+import models
+from idempotency import _fingerprint
+
+
+@pytest.fixture
+def client():
+    models.Base.metadata.drop_all(bind=database.engine)
+    models.Base.metadata.create_all(bind=database.engine)
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def headers(client):
+    client.post("/users/", json={"email": "test@example.com", "username": "testuser", "password": "password123"})
+    response = client.post("/token", data={"username": "test@example.com", "password": "password123"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def with_key(headers, key):
+    return {**headers, "Idempotency-Key": key}
+
+
+def stored_key(key):
+    db = database.SessionLocal()
+    try:
+        return db.query(models.IdempotencyKey).filter(models.IdempotencyKey.key == key).one()
+    finally:
+        db.close()
+
+
+def count_todos():
+    db = database.SessionLocal()
+    try:
+        return db.query(models.Todo).count()
+    finally:
+        db.close()
+
+
+def test_replayed_create_todo_returns_same_todo(client, headers):
+    body = {"task": "買い物"}
+    first = client.post("/todos/", json=body, headers=with_key(headers, "create-1"))
+    second = client.post("/todos/", json=body, headers=with_key(headers, "create-1"))
+
+    assert first.status_code == second.status_code == 200
+    assert second.json() == first.json()
+    assert count_todos() == 1
+
+    record = stored_key("create-1")
+    assert (record.method, record.path) == ("POST", "/todos/")
+    assert record.fingerprint == _fingerprint(main.schemas.TodoCreate(**body).dict())
+
+
+def test_create_todo_with_different_body_is_rejected(client, headers):
+    client.post("/todos/", json={"task": "a"}, headers=with_key(headers, "create-1"))
+    response = client.post("/todos/", json={"task": "b"}, headers=with_key(headers, "create-1"))
+
+    assert response.status_code == 422
+    assert count_todos() == 1
+
+
+def test_replayed_update_todo_does_not_reapply(client, headers):
+    todo_id = client.post("/todos/", json={"task": "a"}, headers=headers).json()["id"]
+
+    first = client.put(f"/todos/{todo_id}", json={"completed": True}, headers=with_key(headers, "update-1"))
+    client.put(f"/todos/{todo_id}", json={"completed": False}, headers=headers)
+    replay = client.put(f"/todos/{todo_id}", json={"completed": True}, headers=with_key(headers, "update-1"))
+
+    assert replay.status_code == 200
+    assert replay.json() == first.json()
+    assert client.get(f"/todos/{todo_id}", headers=headers).json()["completed"] is False
+
+    record = stored_key("update-1")
+    assert (record.method, record.path) == ("PUT", f"/todos/{todo_id}")
+    assert record.fingerprint == _fingerprint({"completed": True})
+
+
+def test_replayed_reorder_does_not_reapply(client, headers):
+    a = client.post("/todos/", json={"task": "a"}, headers=headers).json()["id"]
+    b = client.post("/todos/", json={"task": "b"}, headers=headers).json()["id"]
+
+    first = client.post("/todos/reorder", json=[b, a], headers=with_key(headers, "reorder-1"))
+    client.post("/todos/reorder", json=[a, b], headers=headers)
+    replay = client.post("/todos/reorder", json=[b, a], headers=with_key(headers, "reorder-1"))
+
+    assert replay.json() == first.json()
+    assert [t["id"] for t in client.get("/todos/", headers=headers).json()] == [a, b]
+
+    record = stored_key("reorder-1")
+    assert (record.method, record.path) == ("POST", "/todos/reorder")
+    assert record.fingerprint == _fingerprint([b, a])
+
+
+def test_replayed_category_writes(client, headers):
+    first = client.post("/categories/", json={"name": "c"}, headers=with_key(headers, "category-1"))
+    second = client.post("/categories/", json={"name": "c"}, headers=with_key(headers, "category-1"))
+    assert second.json() == first.json()
+
+    category_id = first.json()["id"]
+    updated = client.put(f"/categories/{category_id}", json={"name": "d"}, headers=with_key(headers, "category-2"))
+    replay = client.put(f"/categories/{category_id}", json={"name": "d"}, headers=with_key(headers, "category-2"))
+    assert replay.json() == updated.json()
+
+
+class BlockFirstListQuery:
+    """最初の一覧取得クエリを止め、一覧取得クエリの実行回数を数える"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.count = 0
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        # 作成時の最大position取得（DESC）は一覧取得ではない
+        if "FROM todos" not in statement or not statement.rstrip().endswith("ORDER BY todos.position"):
+            return
+        self.count += 1
+        if self.count == 1:
+            self.started.set()
+            self.release.wait(5)
+
+
+@pytest.fixture
+def list_query():
+    listener = BlockFirstListQuery()
+    event.listen(database.engine, "before_cursor_execute", listener)
+    yield listener
+    listener.release.set()
+    event.remove(database.engine, "before_cursor_execute", listener)
+
+
+def get_in_thread(client, headers, results):
+    thread = threading.Thread(target=lambda: results.append(client.get("/todos/", headers=headers)))
+    thread.start()
+    return thread
+
+
+def test_concurrent_identical_list_requests_share_one_query(client, headers, list_query):
+    client.post("/todos/", json={"task": "a"}, headers=headers)
+
+    results = []
+    leader = get_in_thread(client, headers, results)
+    assert list_query.started.wait(5)
+    follower = get_in_thread(client, headers, results)
+    time.sleep(0.5)
+    list_query.release.set()
+    leader.join()
+    follower.join()
+
+    assert [r.status_code for r in results] == [200, 200]
+    assert results[0].json() == results[1].json()
+    assert list_query.count == 1
+
+
+def test_list_after_write_does_not_share_older_query(client, headers, list_query):
+    results = []
+    leader = get_in_thread(client, headers, results)
+    assert list_query.started.wait(5)
+
+    client.post("/todos/", json={"task": "new"}, headers=headers)
+    after_write = client.get("/todos/", headers=headers)
+    list_query.release.set()
+    leader.join()
+
+    assert [t["task"] for t in after_write.json()] == ["new"]
+    assert list_query.count == 2
@@ -0,0 +1,261 @@
+# backend/tests/test_reminders.py
+from datetime import datetime, timedelta
+
+import models
+from reminders import ReminderScheduler
+
+START = datetime(2026, 1, 1, 10, 0, 0)
+
+
+class FakeClock:
+    def __init__(self, now: datetime):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def make_scheduler(session_factory, clock, sent, **kwargs):
+    return ReminderScheduler(
+        sink=sent.append,
+        session_factory=session_factory,
+        window=timedelta(minutes=15),
+        refresh_interval=timedelta(seconds=60),
+        lease_duration=timedelta(seconds=30),
+        grace=timedelta(seconds=5),
+        clock=clock,
+        **kwargs,
+    )
+
+
+def add_todo(session_factory, user, task, due_date, completed=False):
+    db = session_factory()
+    todo = models.Todo(task=task, due_date=due_date, completed=completed, user_id=user.id)
+    db.add(todo)
+    db.commit()
+    db.refresh(todo)
+    db.close()
+    return todo
+
+
+def tick(scheduler, clock, now):
+    clock.now = now
+    return scheduler._tick(now)
+
+
+def test_dispatches_only_due_todos_in_window(session_factory, user):
+    clock, sent = FakeClock(START), []
+    scheduler = make_scheduler(session_factory, clock, sent)
+    add_todo(session_factory, user, "past", START - timedelta(minutes=5))
+    add_todo(session_factory, user, "soon", START + timedelta(minutes=1))
+    add_todo(session_factory, user, "done", START + timedelta(minutes=1), completed=True)
+    add_todo(session_factory, user, "later", START + timedelta(minutes=30))
+
+    tick(scheduler, clock, START)
+    assert len(scheduler._heap) == 1
+
+    tick(scheduler, clock, START + timedelta(minutes=2))
+    assert [r.task for r in sent] == ["soon"]
+
+
+def test_in_process_changes_update_heap(session_factory, user):
+    clock, sent = FakeClock(START), []
+    scheduler = make_scheduler(session_factory, clock, sent)
+    tick(scheduler, clock, START)
+
+    created = add_todo(session_factory, user, "created", START + timedelta(seconds=20))
+    scheduler.notify_changed(created)
+    moved = add_todo(session_factory, user, "moved", START + timedelta(seconds=10))
+    scheduler.notify_changed(moved)
+    deleted = add_todo(session_factory, user, "deleted", START + timedelta(seconds=10))
+    scheduler.notify_changed(deleted)
+    scheduler.notify_deleted(deleted.id)
+
+    db = session_factory()
+    db_moved = db.get(models.Todo, moved.id)
+    db_moved.completed = True
+    db.commit()
+    scheduler.notify_changed(db_moved)
+    db.close()
+
+    tick(scheduler, clock, START + timedelta(seconds=30))
+    assert [r.task for r in sent] == ["created"]
+
+
+def test_todo_created_on_other_worker_is_not_skipped_by_watermark(session_factory, user):
+    clock, sent = FakeClock(START), []
+    scheduler = make_scheduler(session_factory, clock, sent)
+    add_todo(session_factory, user, "y", START + timedelta(seconds=50))
+    tick(scheduler, clock, START + timedelta(seconds=20))
+
+    # 他のワーカーで作成されたため、リーダーのヒープには通知されない
+    add_todo(session_factory, user, "x", START + timedelta(seconds=40))
+
+    tick(scheduler, clock, START + timedelta(seconds=50))
+    assert [r.task for r in sent] == ["y"]
+
+    tick(scheduler, clock, START + timedelta(seconds=80))
+    assert [r.task for r in sent] == ["y", "x"]
+
+    tick(scheduler, clock, START + timedelta(seconds=140))
+    assert [r.task for r in sent] == ["y", "x"]
+
+
+def test_truncated_window_does_not_drop_ties(session_factory, user):
+    clock, sent = FakeClock(START), []
+    scheduler = make_scheduler(session_factory, clock, sent, batch_size=2)
+    due = START + timedelta(seconds=10)
+    for i in range(5):
+        add_todo(session_factory, user, f"t{i}", due)
+
+    now = START
+    tick(scheduler, clock, now)
+    assert scheduler._truncated
+    for _ in range(5):
+        now += timedelta(seconds=10)
+        tick(scheduler, clock, now)
+    assert sorted(r.task for r in sent) == ["t0", "t1", "t2", "t3", "t4"]
+
+
+def test_only_one_worker_holds_the_lease(session_factory, user):
+    clock, sent_a, sent_b = FakeClock(START), [], []
+    a = make_scheduler(session_factory, clock, sent_a)
+    b = make_scheduler(session_factory, clock, sent_b)
+    add_todo(session_factory, user, "t", START + timedelta(seconds=10))
+
+    tick(a, clock, START)
+    tick(b, clock, START)
+    assert a._is_leader and not b._is_leader
+
+    tick(a, clock, START + timedelta(seconds=10))
+    tick(b, clock, START + timedelta(seconds=10))
+    assert [r.task for r in sent_a] == ["t"]
+    assert sent_b == []
+
+
+def test_lease_takeover_resumes_without_duplicates(session_factory, user):
+    clock, sent_a, sent_b = FakeClock(START), [], []
+    a = make_scheduler(session_factory, clock, sent_a)
+    b = make_scheduler(session_factory, clock, sent_b)
+    add_todo(session_factory, user, "sent", START + timedelta(seconds=10))
+    add_todo(session_factory, user, "pending", START + timedelta(seconds=90))
+
+    tick(a, clock, START)
+    tick(a, clock, START + timedelta(seconds=10))
+    assert [r.task for r in sent_a] == ["sent"]
+
+    # aが停止したままリースが切れると、bが引き継ぐ
+    tick(b, clock, START + timedelta(seconds=60))
+    assert b._is_leader
+    tick(b, clock, START + timedelta(seconds=90))
+    assert [r.task for r in sent_b] == ["pending"]
+
+    tick(a, clock, START + timedelta(seconds=95))
+    assert not a._is_leader
+    assert [r.task for r in sent_a] == ["sent"]
+
+
+def test_lease_lost_mid_batch_stops_dispatching(session_factory, user):
+    clock, sent_a, sent_b = FakeClock(START), [], []
+    b = make_scheduler(session_factory, clock, sent_b)
+
+    def slow_sink(reminder):
+        # 送信に時間がかかっている間にリースが切れ、bが引き継ぐ
+        sent_a.append(reminder)
+        clock.now += timedelta(seconds=40)
+        tick(b, clock, clock.now)
+
+    a = ReminderScheduler(
+        sink=slow_sink,
+        session_factory=session_factory,
+        lease_duration=timedelta(seconds=30),
+        grace=timedelta(seconds=5),
+        clock=clock,
+    )
+    for i in range(3):
+        add_todo(session_factory, user, f"t{i}", START + timedelta(seconds=10))
+
+    tick(a, clock, START)
+    tick(a, clock, START + timedelta(seconds=10))
+    assert len(sent_a) == 1
+    assert not a._is_leader
+
+    tick(b, clock, clock.now + timedelta(seconds=1))
+    assert sorted(r.task for r in sent_a + sent_b) == ["t0", "t1", "t2"]
+
+
+def test_failed_send_is_retried_on_next_window(session_factory, user):
+    clock, sent, failures = FakeClock(START), [], []
+
+    def flaky_sink(reminder):
+        if not failures:
+            failures.append(reminder)
+            raise OSError("webhook timed out")
+        sent.append(reminder)
+
+    scheduler = ReminderScheduler(
+        sink=flaky_sink,
+        session_factory=session_factory,
+        refresh_interval=timedelta(seconds=60),
+        grace=timedelta(seconds=5),
+        clock=clock,
+    )
+    add_todo(session_factory, user, "t", START + timedelta(seconds=10))
+
+    tick(scheduler, clock, START)
+    tick(scheduler, clock, START + timedelta(seconds=10))
+    assert len(failures) == 1 and sent == []
+
+    # watermarkが進んでも、再試行待ちのものは次の読み込みで拾われる
+    tick(scheduler, clock, START + timedelta(seconds=60))
+    assert [r.task for r in sent] == ["t"]
+
+    tick(scheduler, clock, START + timedelta(seconds=120))
+    assert [r.task for r in sent] == ["t"]
+
+
+def test_failed_send_gives_up_after_max_attempts(session_factory, user):
+    clock, attempts = FakeClock(START), []
+
+    def failing_sink(reminder):
+        attempts.append(reminder)
+        raise OSError("webhook returned 503")
+
+    scheduler = ReminderScheduler(
+        sink=failing_sink,
+        session_factory=session_factory,
+        refresh_interval=timedelta(seconds=60),
+        grace=timedelta(seconds=5),
+        max_attempts=3,
+        clock=clock,
+    )
+    add_todo(session_factory, user, "t", START + timedelta(seconds=10))
+
+    tick(scheduler, clock, START)
+    for minutes in range(1, 7):
+        tick(scheduler, clock, START + timedelta(minutes=minutes))
+    assert len(attempts) == 3
+
+    db = session_factory()
+    lease = db.get(models.SchedulerLease, "due_date_reminders")
+    assert lease.watermark > START + timedelta(seconds=10)
+    db.close()
+
+
+def test_stale_claim_is_retried(session_factory, user):
+    clock, sent = FakeClock(START), []
+    scheduler = make_scheduler(session_factory, clock, sent, claim_timeout=timedelta(minutes=5))
+    todo = add_todo(session_factory, user, "t", START + timedelta(seconds=10))
+
+    # 送信中に停止したワーカーが残した記録
+    db = session_factory()
+    db.add(models.ReminderDelivery(todo_id=todo.id, due_date=todo.due_date, attempts=1, claimed_at=START))
+    db.commit()
+    db.close()
+
+    tick(scheduler, clock, START)
+    tick(scheduler, clock, START + timedelta(minutes=1))
+    assert sent == []
+
+    tick(scheduler, clock, START + timedelta(minutes=6))
+    assert [r.task for r in sent] == ["t"]